@@ -4,65 +4,183 @@ Comprehensive CAN Flag Decoder
 Handles multiple encoding methods commonly used in CTF challenges
 Automatically find 1-8 bits in a log file
 Can also be used to find bits in a remote can frame automatically
-Usage: python3 bit_candecoder.py <logfile.txt> <arbid>
+Usage: python3 bit_candecoder.py <logfile.txt> <arbid> [--cache]
 Example: python3 bit_candecoder.py inter2.log 6F1 
 """
+import os
+import string
 import sys
+import tempfile
+import zipfile
+from array import array
+import numpy as np
 
-def decode_bits_to_string(bit_string, reverse_each_byte=False, stop_at_brace=True):
-    """Convert bit string to ASCII, optionally reversing each byte"""
-    result = ''
-    for i in range(0, len(bit_string), 8):
-        if i + 8 <= len(bit_string):
-            byte = bit_string[i:i+8]
-            if reverse_each_byte:
-                byte = byte[::-1]
-            try:
-                char_val = int(byte, 2)
-                if char_val == ord('}') and stop_at_brace:
-                    result += chr(char_val)
-                    break
-                elif 32 <= char_val <= 126:  # Printable ASCII
-                    result += chr(char_val)
-                else:
-                    if stop_at_brace:
-                        break
-                    result += '.'
-            except:
-                result += '?'
-    return result
+# Maps every byte to itself if printable ASCII, otherwise to '.'
+_PRINT = bytes(i if 32 <= i < 127 else ord('.') for i in range(256))
+_FLAG_BYTES = b'flag{'
 
-def search_for_flag(bit_string, method_name):
-    """Search for flag pattern and decode if found"""
-    # Look for "flag" pattern in binary (MSB format)
-    target = ''.join([format(ord(c), '08b') for c in "flag"])
-    
-    if target in bit_string:
-        pos = bit_string.index(target)
-        adjusted_bits = bit_string[pos:]
-        result = decode_bits_to_string(adjusted_bits, False, True)
-        
-        if result.startswith('flag') and '}' in result:
-            return result, pos
+# Frame kinds
+DATA, REMOTE, EMPTY = 0, 1, 2
+
+def bits_to_string(bits):
+    """Render a 0/1 array as a '0'/'1' string"""
+    return (bits.astype(np.uint8) + ord('0')).tobytes().decode()
+
+def _cache_key(filename, can_id):
+    """Identify a parse of filename for can_id by the log's mtime and size"""
+    st = os.stat(filename)
+    return f'{can_id}:{st.st_mtime_ns}:{st.st_size}'
+
+def load_cache(filename, can_id):
+    """Load cached parse results from <filename>.cache.npz, {} if stale or missing"""
+    try:
+        with np.load(filename + '.cache.npz') as cache:
+            if str(cache['key']) == _cache_key(filename, can_id):
+                return {k: cache[k] for k in cache.files if k != 'key'}
+    except (OSError, KeyError, ValueError, EOFError, zipfile.BadZipFile):
+        pass
+    return {}
+
+def save_cache(filename, can_id, **arrays):
+    """Add parse results to <filename>.cache.npz, keeping other valid entries;
+    a failed write only skips caching"""
+    entries = load_cache(filename, can_id)
+    entries.update(arrays)
+    path = filename + '.cache.npz'
+    # Write to a temp file and rename so an interrupted save can't leave a
+    # truncated cache behind
+    try:
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(path)))
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez_compressed(f, key=_cache_key(filename, can_id), **entries)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def valid_hex_bytes(data):
+    """Drop byte pairs of an even-length hex payload that are not valid hex"""
+    try:
+        bytes.fromhex(data)
+        return data
+    except ValueError:
+        return ''.join(data[i:i+2] for i in range(0, len(data), 2)
+                       if all(c in string.hexdigits for c in data[i:i+2]))
+
+def parse_frames(filename, can_id, cache=False):
+    """Parse a log into per-frame kinds and payload sizes, the concatenated
+    hex payload of all data frames and the raw (timestamp, data) text of
+    the first few data frames, optionally via the parse cache"""
+    if cache:
+        cached = load_cache(filename, can_id)
+        if 'samples' in cached:
+            return (cached['samples'].reshape(-1, 2).tolist(), cached['kinds'],
+                    cached['sizes'], cached['payload'].tobytes().decode('ascii'))
     
-    # Also try LSB format
-    result_lsb = decode_bits_to_string(bit_string, True, False)
-    if 'flag{' in result_lsb.lower():
-        flag_pos = result_lsb.lower().index('flag{')
-        end_pos = result_lsb.find('}', flag_pos)
-        if end_pos != -1:
-            return result_lsb[flag_pos:end_pos+1], flag_pos * 8
+    samples = []
+    kinds = bytearray()
+    sizes = array('H')
+    hex_parts = []
+    with open(filename, 'r', buffering=1 << 20) as f:
+        log = f.read()
+    for line in log.splitlines():
+        if f'{can_id}#' in line:
+            parts = line.strip().split()
+            msg_parts = parts[2].split('#')
+            data = msg_parts[1] if len(msg_parts) > 1 else ''
+            # RTR frames with a DLC are logged as R<dlc>, e.g. 6F1#R8
+            if data.startswith('R'):
+                kinds.append(REMOTE)
+                sizes.append(0)
+            elif data.strip() == '':
+                kinds.append(EMPTY)
+                sizes.append(0)
+            else:
+                if len(samples) < 5:
+                    samples.append((parts[0].strip('()'), data))
+                # Pad to even length and skip any malformed bytes
+                if len(data) % 2 == 1:
+                    data = '0' + data
+                data = valid_hex_bytes(data)
+                kinds.append(DATA)
+                sizes.append(len(data) // 2)
+                hex_parts.append(data)
+    kinds = np.frombuffer(kinds, dtype=np.uint8)
+    sizes = np.frombuffer(sizes, dtype=np.uint16)
+    hex_concat = ''.join(hex_parts)
+    if cache:
+        save_cache(filename, can_id, samples=np.array(samples, dtype=str),
+                   kinds=kinds, sizes=sizes,
+                   payload=np.frombuffer(hex_concat.encode('ascii'), dtype=np.uint8))
+    return samples, kinds, sizes, hex_concat
+
+def decode_bits_to_string(bits, reverse_each_byte=False, stop_at_brace=True):
+    """Convert a 0/1 bit array to ASCII, optionally reversing each byte"""
+    bits = bits[:bits.size - bits.size % 8]
+    if reverse_each_byte:
+        bits = bits.reshape(-1, 8)[:, ::-1].ravel()
+    packed = np.packbits(bits)
+    
+    printable = (packed >= 32) & (packed <= 126)  # Printable ASCII
+    if stop_at_brace:
+        # Stop at the first non-printable byte, keeping a closing brace
+        stops = np.flatnonzero(~printable | (packed == ord('}')))
+        if stops.size:
+            end = stops[0]
+            packed = packed[:end + 1] if packed[end] == ord('}') else packed[:end]
+    else:
+        packed = np.where(printable, packed, ord('.')).astype(np.uint8)
+    return packed.tobytes().decode('ascii')
+
+def pack_bits_to_bytes(bits, offset=0, lsb_first=False):
+    """Pack a 0/1 bit array into bytes, dropping any trailing partial byte"""
+    usable = max(bits.size - offset, 0) // 8 * 8
+    chunk = bits[offset:offset + usable]
+    if lsb_first:
+        chunk = chunk.reshape(-1, 8)[:, ::-1]
+    return np.packbits(chunk).tobytes()
+
+def search_for_flag(bits, method_name):
+    """Search for flag pattern at every bit alignment and decode if found"""
+    # Try MSB format first, then LSB; keep the earliest match over all offsets
+    for lsb_first in (False, True):
+        best = None
+        for offset in range(8):
+            buf = pack_bits_to_bytes(bits, offset, lsb_first)
+            pos = buf.find(_FLAG_BYTES)
+            while pos != -1:
+                end = buf.find(b'}', pos)
+                if end == -1:
+                    break
+                flag = buf[pos:end+1]
+                # MSB flags must be printable all the way to the closing brace
+                if lsb_first or flag.translate(_PRINT) == flag:
+                    bit_pos = offset + pos * 8
+                    if best is None or bit_pos < best[1]:
+                        best = (flag.translate(_PRINT).decode('ascii'), bit_pos)
+                    break
+                pos = buf.find(_FLAG_BYTES, pos + 1)
+        if best:
+            return best
     
     return None, -1
 
 def main():
-    if len(sys.argv) < 3:
-        print("Usage: python3 bit_candecoder.py <logfile> <can_id>")
+    cache = '--cache' in sys.argv[1:]
+    args = [a for a in sys.argv[1:] if a != '--cache']
+    
+    if len(args) < 2:
+        print("Usage: python3 bit_candecoder.py <logfile> <can_id> [--cache]")
         print("Example: python3 bit_candecoder.py capture.log 6F0")
         sys.exit(1)
     
-    filename = sys.argv[1]
-    can_id = sys.argv[2].upper()
+    filename = args[0]
+    can_id = args[1].upper()
     
     print("="*70)
     print("Comprehensive CAN Flag Decoder")
@@ -72,26 +190,18 @@ def main():
     print("="*70)
     
     # Collect all frames
-    frames = []
-    with open(filename, 'r') as f:
-        for line in f:
-            if f'{can_id}#' in line:
-                parts = line.strip().split()
-                timestamp = parts[0].strip('()')
-                msg_parts = parts[2].split('#')
-                data = msg_parts[1] if len(msg_parts) > 1 else ''
-                frames.append((timestamp, data))
-    
-    if not frames:
+    samples, kinds, sizes, hex_concat = parse_frames(filename, can_id, cache)
+    
+    if kinds.size == 0:
         print(f"\n❌ No frames found for CAN ID {can_id}")
         sys.exit(1)
     
-    print(f"\nTotal frames collected: {len(frames)}")
+    print(f"\nTotal frames collected: {kinds.size}")
     
     # Analyze frame types
-    remote_frames = sum(1 for _, d in frames if d == 'R')
-    empty_frames = sum(1 for _, d in frames if d == '' or d.strip() == '')
-    data_frames = len(frames) - remote_frames - empty_frames
+    remote_frames = int(np.count_nonzero(kinds == REMOTE))
+    empty_frames = int(np.count_nonzero(kinds == EMPTY))
+    data_frames = kinds.size - remote_frames - empty_frames
     
     print(f"  Remote frames (R): {remote_frames}")
     print(f"  Empty frames: {empty_frames}")
@@ -100,108 +210,46 @@ def main():
     # Show sample of data frames
     if data_frames > 0:
         print(f"\nSample data frames:")
-        count = 0
-        for ts, data in frames:
-            if data and data != 'R' and data.strip() != '':
-                print(f"  {ts}: {can_id}#{data}")
-                count += 1
-                if count >= 5:
-                    break
+        for ts, data in samples:
+            print(f"  {ts}: {can_id}#{data}")
     
     print("\n" + "="*70)
     print("Trying different encoding methods:")
     print("="*70)
     
     methods = []
+    # Data bytes seen up to and including each frame
+    byte_ends = np.cumsum(sizes, dtype=np.int64)
+    lsbs = np.frombuffer(bytes.fromhex(hex_concat), dtype=np.uint8) & 1
     
     # METHOD 1: LSB of data bytes (like 6F0 easy challenge)
-    if data_frames > 0:
-        bits = []
-        for ts, data in frames:
-            if data and data != 'R' and data.strip() != '':
-                # Pad to even length
-                if len(data) % 2 == 1:
-                    data = '0' + data
-                # Extract LSB from each byte
-                for i in range(0, len(data), 2):
-                    if i + 2 <= len(data):
-                        try:
-                            byte_val = int(data[i:i+2], 16)
-                            bits.append(str(byte_val & 1))
-                        except:
-                            pass
-        
-        if bits:
-            bit_string = ''.join(bits)
-            methods.append(("Method 1: LSB from data bytes", bit_string))
+    if lsbs.size > 0:
+        methods.append(("Method 1: LSB from data bytes", lsbs))
     
-    # METHOD 2: R=1, Empty=0 (like 6F1 intermediate challenge)
+    # METHODS 2 and 3: remote/empty frames only, skipping actual data frames
     if remote_frames > 0 and empty_frames > 0:
-        bits = []
-        for ts, data in frames:
-            # Skip actual data frames
-            if data and data != 'R' and data.strip() != '':
-                continue
-            if data == 'R':
-                bits.append('1')
-            else:  # Empty
-                bits.append('0')
-        
-        if bits:
-            bit_string = ''.join(bits)
-            methods.append(("Method 2: R=1, Empty=0", bit_string))
-    
-    # METHOD 3: R=0, Empty=1 (opposite mapping)
-    if remote_frames > 0 and empty_frames > 0:
-        bits = []
-        for ts, data in frames:
-            # Skip actual data frames
-            if data and data != 'R' and data.strip() != '':
-                continue
-            if data == 'R':
-                bits.append('0')
-            else:  # Empty
-                bits.append('1')
-        
-        if bits:
-            bit_string = ''.join(bits)
-            methods.append(("Method 3: R=0, Empty=1", bit_string))
+        is_remote = (kinds[kinds != DATA] == REMOTE).astype(np.uint8)
+        # METHOD 2: R=1, Empty=0 (like 6F1 intermediate challenge)
+        methods.append(("Method 2: R=1, Empty=0", is_remote))
+        # METHOD 3: R=0, Empty=1 (opposite mapping)
+        methods.append(("Method 3: R=0, Empty=1", 1 - is_remote))
     
-    # METHOD 4: All frames (including empty as 0x00)
+    # METHOD 4: All frames (including empty as 0x00), remote frames add nothing
     if empty_frames > 0:
-        bits = []
-        for ts, data in frames:
-            if data == 'R':
-                continue  # Skip remote frames
-            elif data == '' or data.strip() == '':
-                # Treat empty as 0x00 (bit=0)
-                bits.append('0')
-            else:
-                # Extract LSB from data
-                if len(data) % 2 == 1:
-                    data = '0' + data
-                for i in range(0, len(data), 2):
-                    if i + 2 <= len(data):
-                        try:
-                            byte_val = int(data[i:i+2], 16)
-                            bits.append(str(byte_val & 1))
-                        except:
-                            pass
-        
-        if bits:
-            bit_string = ''.join(bits)
-            methods.append(("Method 4: Empty=0x00, extract LSB from all", bit_string))
+        # Each empty frame becomes a 0 bit at its position in the data stream
+        bits = np.insert(lsbs, byte_ends[kinds == EMPTY], 0)
+        methods.append(("Method 4: Empty=0x00, extract LSB from all", bits))
     
     # Try each method
     found_flags = []
     
-    for method_name, bit_string in methods:
+    for method_name, bits in methods:
         print(f"\n{method_name}")
-        print(f"  Bits collected: {len(bit_string)}")
-        print(f"  First 80 bits: {bit_string[:80]}")
+        print(f"  Bits collected: {bits.size}")
+        print(f"  First 80 bits: {bits_to_string(bits[:80])}")
         
         # Try original bitstring
-        flag, pos = search_for_flag(bit_string, method_name)
+        flag, pos = search_for_flag(bits, method_name)
         if flag and flag.startswith('flag'):
             print(f"  ✓ Found at bit position {pos}")
             print(f"  🚩 FLAG: {flag}")
@@ -209,8 +257,7 @@ def main():
             continue
         
         # Try reversed bitstring
-        reversed_bits = bit_string[::-1]
-        flag, pos = search_for_flag(reversed_bits, method_name + " (reversed)")
+        flag, pos = search_for_flag(bits[::-1], method_name + " (reversed)")
         if flag and flag.startswith('flag'):
             print(f"  ✓ Found in REVERSED bitstring at position {pos}")
             print(f"  🚩 FLAG: {flag}")
@@ -218,7 +265,7 @@ def main():
             continue
         
         # Show preview decode
-        preview = decode_bits_to_string(bit_string[:min(400, len(bit_string))], False, False)
+        preview = decode_bits_to_string(bits[:400], False, False)
         print(f"  Preview: {preview[:60]}")
     
     # Summary
@@ -1,103 +1,153 @@
 #!/usr/bin/env python3
 # decode_flag.py
 # Decodes CAN timing-based covert channel with given threshold
+import os
 import sys
-import re
+import tempfile
+import zipfile
+from array import array
+import numpy as np
 
-def parse_timestamps(filename, canid):
-    """Extract timestamps for a specific CAN ID"""
-    ts = []
-    pat = re.compile(r'\(?\s*([0-9]+\.[0-9]+)\s*\)?.*?\b' + re.escape(canid) + r'\b#')
-    with open(filename, 'r', errors='ignore') as f:
-        for line in f:
-            m = pat.search(line)
-            if m:
-                try:
-                    ts.append(float(m.group(1)))
-                except:
-                    pass
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+# Maps every byte to itself if printable ASCII, otherwise to '.'
+_PRINT = bytes(i if 32 <= i < 127 else ord('.') for i in range(256))
+_FLAG_BYTES = b'flag{'
+
+def _cache_key(filename, canid):
+    """Identify a parse of filename for canid by the log's mtime and size"""
+    st = os.stat(filename)
+    return f'{canid}:{st.st_mtime_ns}:{st.st_size}'
+
+def load_cache(filename, canid):
+    """Load cached parse results from <filename>.cache.npz, {} if stale or missing"""
+    try:
+        with np.load(filename + '.cache.npz') as cache:
+            if str(cache['key']) == _cache_key(filename, canid):
+                return {k: cache[k] for k in cache.files if k != 'key'}
+    except (OSError, KeyError, ValueError, EOFError, zipfile.BadZipFile):
+        pass
+    return {}
+
+def save_cache(filename, canid, **arrays):
+    """Add parse results to <filename>.cache.npz, keeping other valid entries;
+    a failed write only skips caching"""
+    entries = load_cache(filename, canid)
+    entries.update(arrays)
+    path = filename + '.cache.npz'
+    # Write to a temp file and rename so an interrupted save can't leave a
+    # truncated cache behind
+    try:
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(path)))
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez_compressed(f, key=_cache_key(filename, canid), **entries)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def parse_timestamps(filename, canid, cache=False):
+    """Extract timestamps for a specific CAN ID, optionally via the parse cache"""
+    if cache:
+        cached = load_cache(filename, canid)
+        if 'ts' in cached:
+            return cached['ts']
+    
+    ts = array('d')
+    needle = f'{canid}#'
+    with open(filename, 'r', buffering=1 << 20, errors='ignore') as f:
+        data = f.read()
+    for line in data.splitlines():
+        pos = line.find(needle)
+        if pos == -1:
+            continue
+        # Reject longer IDs that merely end in canid (e.g. 16F2# for 6F2)
+        if pos > 0 and (line[pos-1].isalnum() or line[pos-1] == '_'):
+            continue
+        try:
+            ts.append(float(line.split(None, 1)[0].strip('()')))
+        except ValueError:
+            pass
+    ts = np.frombuffer(ts, dtype=np.float64)
+    if cache:
+        save_cache(filename, canid, ts=ts)
     return ts
 
 def gaps_from_timestamps(ts):
     """Calculate time gaps between consecutive frames"""
-    return [ts[i] - ts[i-1] for i in range(1, len(ts))]
+    return np.diff(ts)
+
+if njit is not None:
+    @njit(parallel=True, cache=True, boundscheck=False)
+    def _bits(gaps, threshold, short_one):
+        """Convert a float64 gap array to a uint8 array of 0/1 bits"""
+        out = np.empty(gaps.size, np.uint8)
+        for i in prange(gaps.size):
+            out[i] = (1 if gaps[i] < threshold else 0) ^ (0 if short_one else 1)
+        return out
+else:
+    def _bits(gaps, threshold, short_one):
+        """Convert a float64 gap array to a uint8 array of 0/1 bits"""
+        return ((gaps < threshold) == short_one).astype(np.uint8)
 
 def bits_from_gaps(gaps, threshold, short_is='1'):
-    """Convert gaps to bits using threshold"""
-    bits = []
-    for g in gaps:
-        bits.append(short_is if g < threshold else ('1' if short_is == '0' else '0'))
-    return ''.join(bits)
+    """Convert gaps to a uint8 array of 0/1 bits using threshold"""
+    return _bits(np.asarray(gaps, dtype=np.float64), threshold, short_is == '1')
+
+def pack_bits_to_bytes(bits, offset=0, lsb_first=False):
+    """Pack a 0/1 bit array into bytes, dropping any trailing partial byte"""
+    usable = max(bits.size - offset, 0) // 8 * 8
+    chunk = bits[offset:offset + usable]
+    if lsb_first:
+        chunk = chunk.reshape(-1, 8)[:, ::-1]
+    return np.packbits(chunk).tobytes()
 
-def pack_bits_to_bytes(bitstr, offset=0, lsb_first=False):
-    """Pack bit string into bytes"""
-    out = []
-    s = bitstr[offset:]
-    for i in range(0, len(s), 8):
-        chunk = s[i:i+8]
-        if len(chunk) < 8:
-            break
-        out.append(int(chunk[::-1], 2) if lsb_first else int(chunk, 2))
-    return out
+def _sequential_flag(translated, flag_pos, max_search):
+    """Collect flag{...} from flag_pos up to the first '}', dropping '.' bytes"""
+    window = translated[flag_pos:flag_pos + max_search]
+    end = window.find(b'}')
+    if end == -1:
+        return None
+    return window[:end + 1].replace(b'.', b'').decode('ascii')
 
 def extract_flag(bs, max_search=200):
     """Extract complete flag - handles wrapped and reversed flags"""
-    s = ''.join(chr(b) if 32 <= b < 127 else '.' for b in bs)
+    translated = bs.translate(_PRINT)
     
     # Try forward
-    flag_pos = s.lower().find('flag{')
-    closing_pos = s.find('}')
+    flag_pos = translated.find(_FLAG_BYTES)
+    closing_pos = translated.find(b'}')
     
     if flag_pos != -1 and closing_pos != -1:
         # Wrapped flag: flag{ at end, } at beginning
         if flag_pos > closing_pos:
-            beginning = ''
-            for i in range(min(closing_pos + 1, len(s))):
-                char = s[i]
-                if char != '.':
-                    beginning += char
-                if char == '}':
-                    break
-            
-            ending = ''
-            for i in range(flag_pos, len(s)):
-                char = s[i]
-                if char != '.':
-                    ending += char
+            beginning = translated[:closing_pos + 1].replace(b'.', b'')
+            ending = translated[flag_pos:].replace(b'.', b'')
             
             result = ending + beginning
-            if result.startswith('flag{') and '}' in result:
-                return result
+            if result.startswith(_FLAG_BYTES):
+                return result.decode('ascii')
         
         # Normal sequential flag
         else:
-            result = ''
-            for i in range(flag_pos, min(flag_pos + max_search, len(s))):
-                char = s[i]
-                if char == '}':
-                    result += char
-                    break
-                elif char != '.':
-                    result += char
-            if result.startswith('flag') and '}' in result:
+            result = _sequential_flag(translated, flag_pos, max_search)
+            if result:
                 return result
     
     # Try byte-reversed
-    bs_reversed = bs[::-1]
-    s_reversed = ''.join(chr(b) if 32 <= b < 127 else '.' for b in bs_reversed)
+    translated = bs[::-1].translate(_PRINT)
     
-    flag_pos = s_reversed.lower().find('flag{')
+    flag_pos = translated.find(_FLAG_BYTES)
     if flag_pos != -1:
-        result = ''
-        for i in range(flag_pos, min(flag_pos + max_search, len(s_reversed))):
-            char = s_reversed[i]
-            if char == '}':
-                result += char
-                break
-            elif char != '.':
-                result += char
-        if result.startswith('flag') and '}' in result:
-            return result
+        return _sequential_flag(translated, flag_pos, max_search)
     
     return None
 
@@ -105,11 +155,13 @@ def try_all_combinations(gaps, threshold):
     """Try all parameter combinations to find the flag"""
     results = []
     
-    for short_is in ['0', '1']:
+    # Classify the gaps once; the opposite mapping is just the inverted bits
+    bits_one = bits_from_gaps(gaps, threshold, '1')
+    
+    for short_is, bits in [('0', 1 - bits_one), ('1', bits_one)]:
         for offset in range(8):
             for lsb_first in [False, True]:
-                bitstr = bits_from_gaps(gaps, threshold, short_is)
-                bs = pack_bits_to_bytes(bitstr, offset, lsb_first)
+                bs = pack_bits_to_bytes(bits, offset, lsb_first)
                 
                 flag = extract_flag(bs)
                 if flag and flag not in [r[4] for r in results]:
@@ -119,20 +171,23 @@ def try_all_combinations(gaps, threshold):
     return results
 
 if __name__ == '__main__':
-    if len(sys.argv) < 4:
-        print("Usage: python3 decode_flag.py <logfile> <ARB_ID> <threshold>")
+    cache = '--cache' in sys.argv[1:]
+    args = [a for a in sys.argv[1:] if a != '--cache']
+    
+    if len(args) < 3:
+        print("Usage: python3 decode_flag.py <logfile> <ARB_ID> <threshold> [--cache]")
         print("\nExample: python3 decode_flag.py dif3.log 6F2 0.000791")
         print("\nTip: Use find_threshold.py first to determine the threshold")
         sys.exit(1)
     
-    logfile = sys.argv[1]
-    canid = sys.argv[2].upper()
-    threshold = float(sys.argv[3])
+    logfile = args[0]
+    canid = args[1].upper()
+    threshold = float(args[2])
     
     print(f"[+] Parsing {logfile} for CAN ID {canid}...")
-    ts = parse_timestamps(logfile, canid)
+    ts = parse_timestamps(logfile, canid, cache)
     
-    if not ts:
+    if len(ts) == 0:
         print("[-] No timestamps found!")
         sys.exit(1)
     
@@ -166,9 +221,9 @@ if __name__ == '__main__':
         
         # Show a sample decode for debugging
         print("\n[*] Sample decode (MSB, short=1, offset=0):")
-        bitstr = bits_from_gaps(gaps, threshold, '1')
-        bs = pack_bits_to_bytes(bitstr, 0, False)
-        preview = ''.join(chr(b) if 32 <= b < 127 else '.' for b in bs[:100])
-        preview_rev = ''.join(chr(b) if 32 <= b < 127 else '.' for b in bs[::-1][:100])
+        bits = bits_from_gaps(gaps, threshold, '1')
+        bs = pack_bits_to_bytes(bits, 0, False)
+        preview = bs[:100].translate(_PRINT).decode('latin-1')
+        preview_rev = bs[::-1][:100].translate(_PRINT).decode('latin-1')
         print(f"    Forward:  {preview}")
         print(f"    Reversed: {preview_rev}")